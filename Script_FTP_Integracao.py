@@ -1,16 +1,40 @@
 import os
 import psycopg2
-from ftplib import FTP
+import psycopg2.extras
+from ftplib import FTP, all_errors
 import logging
 from dotenv import load_dotenv
 import re
 from datetime import datetime
 import tempfile
+import io
+import csv
+import queue
+import threading
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+FTP_BLOCKSIZE = 256 * 1024
+FTP_WRITE_BUFFER = 1024 * 1024
+
+DOWNLOAD_OK = object()
+DOWNLOAD_FAILED = object()
+
+_FNAME_RE = re.compile(r'[\\/*?:"<>|]')
+_FILE_TS_RE = re.compile(r'(\d{8,14})')
+
+class _DigitsOnly(dict):
+    # Tabela para str.translate: mantém 0-9 e remove qualquer outro caractere,
+    # memorizando cada código já visto.
+    def __missing__(self, key):
+        value = key if 48 <= key <= 57 else None
+        self[key] = value
+        return value
+
+_DIGITS_ONLY = _DigitsOnly()
+
 def connect_db():
     try:
         conn = psycopg2.connect(
@@ -20,24 +44,109 @@ def connect_db():
             password=os.getenv("DB_PASSWORD"),
             port=int(os.getenv("DB_PORT", 5432))
         )
+        conn.autocommit = False
         logging.info("Conexão com o banco de dados estabelecida.")
         return conn
     except psycopg2.Error as e:
         logging.error(f"Erro ao conectar ao banco de dados: {e}")
         return None
 
+MOTORISTA_CPF_UNIQUE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS motorista_cpf_uidx ON motorista (mot_cpf)"
+MOTORISTA_CPF_INDEX = "CREATE INDEX IF NOT EXISTS motorista_cpf_idx ON motorista (mot_cpf)"
+MOTORISTA_CPF_INDEX_DROP = "DROP INDEX IF EXISTS motorista_cpf_idx"
+
+MOTORISTA_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS motorista_nom_upper_idx ON motorista (UPPER(mot_nom))",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS motorista_nom_trgm_idx ON motorista USING gin (UPPER(mot_nom) gin_trgm_ops)",
+]
+
+def cpf_index_statement(conn):
+    # Com CPFs duplicados o índice único nunca seria criado, e cada tentativa
+    # bloquearia escritas em motorista até falhar; nesse caso fica o btree comum.
+    with conn.cursor() as cursor:
+        existe = has_cpf_unique_index(cursor)
+        duplicados = False
+        if not existe:
+            cursor.execute("""
+                SELECT EXISTS (
+                    SELECT 1
+                    FROM motorista
+                    WHERE mot_cpf IS NOT NULL
+                    GROUP BY mot_cpf
+                    HAVING count(*) > 1
+                )
+            """)
+            duplicados = cursor.fetchone()[0]
+    conn.commit()
+
+    if existe:
+        return None
+    if duplicados:
+        logging.warning("CPFs duplicados em motorista; índice único em mot_cpf não será criado")
+        return MOTORISTA_CPF_INDEX
+    return MOTORISTA_CPF_UNIQUE_INDEX
+
+def run_index_statement(conn, statement):
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(statement)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.warning(f"Não foi possível executar '{statement}': {e}")
+        return False
+
+def ensure_indexes(conn):
+    try:
+        statement = cpf_index_statement(conn)
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.warning(f"Não foi possível verificar CPFs duplicados em motorista: {e}")
+        statement = MOTORISTA_CPF_INDEX
+
+    if statement == MOTORISTA_CPF_UNIQUE_INDEX and not run_index_statement(conn, statement):
+        statement = MOTORISTA_CPF_INDEX
+    if statement == MOTORISTA_CPF_INDEX:
+        run_index_statement(conn, statement)
+    else:
+        # Com o índice único em vigor, o btree comum de uma execução anterior
+        # só custaria escrita a mais.
+        run_index_statement(conn, MOTORISTA_CPF_INDEX_DROP)
+
+    for statement in MOTORISTA_INDEXES:
+        run_index_statement(conn, statement)
+
 def sanitize_filename(filename):
-    return re.sub(r'[\\/*?:"<>|]', "", filename)
+    return _FNAME_RE.sub("", filename)
 
 def formatar_cpf(cpf):
     if not cpf or not cpf.strip():
         return None
     
-    cpf = re.sub(r'\D', '', cpf)
+    cpf = cpf.translate(_DIGITS_ONLY)
     if len(cpf) == 11:
         return f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
     return None
 
+def copy_field(value):
+    if value is None:
+        return "\\N"
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+def copy_rows(cursor, table, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_field(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} FROM STDIN", buffer)
+
 def get_download_directory():
     download_dir = os.path.join(os.path.expanduser("~"), "Downloads", "ftp_hps")
     
@@ -64,7 +173,26 @@ def get_download_directory():
     logging.warning(f"Usando diretório do script: {download_dir}")
     return download_dir
 
-def download_ftp_file():
+def latest_by_filename(files):
+    # Quando a maioria dos arquivos traz a data no nome (yyyymmdd[hhmm[ss]]),
+    # o mais recente sai da própria listagem, sem MLSD/MDTM.
+    stamped = []
+    for name in files:
+        match = _FILE_TS_RE.search(os.path.basename(name))
+        if not match:
+            continue
+        stamp = match.group(1)
+        try:
+            datetime.strptime(stamp[:8], "%Y%m%d")
+        except ValueError:
+            continue
+        stamped.append((stamp.ljust(14, "0"), name))
+
+    if len(stamped) * 2 <= len(files):
+        return None
+    return max(stamped)[1]
+
+def download_ftp_file(on_chunk=None):
     ftp = None
     local_filename = None
     
@@ -79,12 +207,28 @@ def download_ftp_file():
             logging.warning("Nenhum arquivo encontrado no FTP.")
             return None
 
-        try:
-            latest_file = max(files, key=lambda x: datetime.strptime(ftp.sendcmd(f"MDTM {x}").split()[1], "%Y%m%d%H%M%S"))
-            logging.info(f"Arquivo mais recente encontrado (via MDTM): {latest_file}")
-        except:
-            latest_file = files[-1]
-            logging.warning(f"MDTM não suportado, usando último arquivo da lista: {latest_file}")
+        latest_file = latest_by_filename(files)
+        if latest_file:
+            logging.info(f"Arquivo mais recente encontrado (via data no nome): {latest_file}")
+        else:
+            try:
+                entries = [(name, facts) for name, facts in ftp.mlsd(facts=["type", "modify"])
+                           if facts.get("type", "file") == "file" and "modify" in facts]
+                if entries:
+                    latest_file = max(entries, key=lambda e: e[1]["modify"])[0]
+                    logging.info(f"Arquivo mais recente encontrado (via MLSD): {latest_file}")
+                else:
+                    logging.warning("MLSD sem data de modificação, tentando MDTM...")
+            except all_errors as e:
+                logging.warning(f"MLSD não suportado ({e}), tentando MDTM...")
+
+            if not latest_file:
+                try:
+                    latest_file = max(files, key=lambda x: datetime.strptime(ftp.sendcmd(f"MDTM {x}").split()[1], "%Y%m%d%H%M%S"))
+                    logging.info(f"Arquivo mais recente encontrado (via MDTM): {latest_file}")
+                except:
+                    latest_file = files[-1]
+                    logging.warning(f"MDTM não suportado, usando último arquivo da lista: {latest_file}")
         
         download_dir = get_download_directory()
         local_filename = os.path.join(download_dir, sanitize_filename(os.path.basename(latest_file)))
@@ -100,8 +244,13 @@ def download_ftp_file():
                 logging.info(f"Usando nome alternativo: {local_filename}")
 
         logging.info(f"Iniciando download para: {local_filename}")
-        with open(local_filename, 'wb') as local_file:
-            ftp.retrbinary(f'RETR {latest_file}', local_file.write)
+        with open(local_filename, 'wb', buffering=FTP_WRITE_BUFFER) as local_file:
+            def write_chunk(chunk):
+                local_file.write(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+
+            ftp.retrbinary(f'RETR {latest_file}', write_chunk, blocksize=FTP_BLOCKSIZE)
 
         logging.info(f"Arquivo {latest_file} baixado com sucesso para {local_filename}")
         return local_filename
@@ -124,174 +273,411 @@ def download_ftp_file():
             except:
                 pass
 
-def find_motorista(cursor, mot_nom, mot_cpf):
-    if mot_cpf:
-        cursor.execute("SELECT mot_id, mot_nom FROM motorista WHERE mot_cpf = %s", (mot_cpf,))
-        result = cursor.fetchone()
-        if result:
-            logging.info(f" Motorista encontrado por CPF: ID {result[0]}, Nome: {result[1]}")
-            return result[0]
-    
+def load_motoristas(cursor):
+    # Carrega o cadastro inteiro uma vez; CPF e nome exato passam a ser
+    # resolvidos em memória e só a busca por similaridade vai ao banco
+    # (ver find_similares).
+    cursor.execute("""
+        SELECT mot_id, cli_id, mot_nom, mot_tel, mot_cnh, mot_cpf, mot_rua, mot_num, mot_bai, mot_cid, mot_uf
+        FROM motorista
+        ORDER BY mot_id
+    """)
+    by_cpf = {}
+    by_name = {}
+    atuais = {}
+    for row in cursor:
+        mot_id, mot_nom, mot_cpf = row[0], row[2], row[5]
+        atuais[mot_id] = row[1:]
+        if mot_cpf:
+            by_cpf.setdefault(mot_cpf, (mot_id, mot_nom))
+        if mot_nom:
+            by_name.setdefault(mot_nom.strip().upper(), (mot_id, mot_nom))
+    logging.info(f" {cursor.rowcount} motoristas carregados do banco")
+    return by_cpf, by_name, atuais
+
+def has_cpf_unique_index(cursor):
+    cursor.execute("""
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = 'motorista'::regclass
+          AND i.indisunique AND i.indnatts = 1 AND i.indpred IS NULL
+          AND a.attname = 'mot_cpf'
+    """)
+    return cursor.fetchone() is not None
+
+def find_similares(cursor, nomes):
+    # Uma única consulta para todos os nomes sem correspondência exata,
+    # no lugar de um LIKE por linha do arquivo. Reflete o banco antes do
+    # arquivo; find_similar completa com o que o próprio arquivo alterou.
+    similares = {nome: [] for nome in nomes}
+    if not nomes:
+        return similares
+    cursor.execute("""
+        SELECT n.nome, m.mot_id, m.mot_nom
+        FROM unnest(%s::text[]) AS n(nome)
+        CROSS JOIN LATERAL (
+            SELECT mot_id, mot_nom
+            FROM motorista
+            WHERE UPPER(mot_nom) LIKE '%%' || n.nome || '%%'
+        ) m
+    """, (list(nomes),))
+    for nome, mot_id, mot_nom in cursor:
+        similares[nome].append((mot_id, mot_nom))
+    return similares
+
+def find_motorista(mot_nom, mot_cpf, by_cpf, by_name):
     mot_nom_clean = mot_nom.strip().upper()
     
-    cursor.execute("SELECT mot_id, mot_nom FROM motorista WHERE UPPER(mot_nom) = %s", (mot_nom_clean,))
-    result = cursor.fetchone()
-    if result:
-        logging.info(f" Motorista encontrado por nome exato: ID {result[0]}, Nome: {result[1]}")
-        return result[0]
+    if mot_cpf and mot_cpf in by_cpf:
+        mot_id, nome = by_cpf[mot_cpf]
+        logging.info(f" Motorista encontrado por CPF: ID {mot_id}, Nome: {nome}")
+        return mot_id
     
-    cursor.execute("""
-        SELECT mot_id, mot_nom 
-        FROM motorista 
-        WHERE UPPER(mot_nom) LIKE %s OR UPPER(mot_nom) LIKE %s
-    """, (f"{mot_nom_clean}%", f"%{mot_nom_clean}%"))
+    if mot_nom_clean in by_name:
+        mot_id, nome = by_name[mot_nom_clean]
+        logging.info(f" Motorista encontrado por nome exato: ID {mot_id}, Nome: {nome}")
+        return mot_id
+    
+    return None
+
+def find_similar(cursor, mot_nom, similares, motoristas_update, motoristas_insert):
+    # Busca por similaridade sobre o estado atual: o resultado do banco (sem os
+    # motoristas já alterados por linhas anteriores) mais os nomes atualizados
+    # e os cadastros pendentes deste arquivo. Retorna (mot_id, novo_idx).
+    mot_nom_clean = mot_nom.strip().upper()
+    if mot_nom_clean not in similares:
+        similares.update(find_similares(cursor, {mot_nom_clean}))
+    
+    results = [(mot_id, None, nome) for mot_id, nome in similares[mot_nom_clean]
+               if mot_id not in motoristas_update]
+    results += [(mot_id, None, valores[1]) for mot_id, valores in motoristas_update.items()
+                if mot_nom_clean in valores[1].upper()]
+    results += [(None, idx, valores[1]) for idx, valores in enumerate(motoristas_insert)
+                if mot_nom_clean in valores[1].upper()]
     
-    results = cursor.fetchall()
     if len(results) == 1:
-        logging.info(f" Motorista encontrado por similaridade: ID {results[0][0]}, Nome: {results[0][1]}")
-        return results[0][0]
+        mot_id, novo_idx, nome = results[0]
+        logging.info(f" Motorista encontrado por similaridade: ID {mot_id if mot_id is not None else 'novo'}, Nome: {nome}")
+        return mot_id, novo_idx
     elif len(results) > 1:
-        logging.warning(f" Múltiplos motoristas encontrados para nome similar '{mot_nom}': {[r[1] for r in results]}")
+        logging.warning(f" Múltiplos motoristas encontrados para nome similar '{mot_nom}': {[r[2] for r in results]}")
     
-    return None
+    return None, None
+
+def drop_stale_keys(index_cpf, index_name, anteriores, valores, ref, ident=lambda entry: entry):
+    # Remove as chaves de CPF/nome que o motorista `ref` deixou de ter ao
+    # receber `valores`. `ident` extrai a referência de cada entrada do índice.
+    # Retorna True se alguma chave foi removida.
+    removed = False
+    anterior_cpf, anterior_nome = anteriores[4], (anteriores[1] or "").strip().upper()
+    if anterior_cpf and anterior_cpf != valores[4] and anterior_cpf in index_cpf and ident(index_cpf[anterior_cpf]) == ref:
+        del index_cpf[anterior_cpf]
+        removed = True
+    if anterior_nome != valores[1].strip().upper() and anterior_nome in index_name and ident(index_name[anterior_nome]) == ref:
+        del index_name[anterior_nome]
+        removed = True
+    return removed
+
+def resolve_motoristas(cursor, registros, by_cpf, by_name, atuais, similares):
+    linhas = []
+    motoristas_update = {}
+    motoristas_insert = []
+    novos_por_cpf = {}
+    novos_por_nome = {}
+    mot_cache = {}
+
+    for line_number, vei_id, vei_plc, placa_car, valores in registros:
+        mot_nom, mot_cpf = valores[1], valores[4]
+        mot_nom_clean = mot_nom.strip().upper()
+
+        logging.info(f"Processando: Motorista '{mot_nom}', CPF: {mot_cpf}, Veículo: {vei_id}")
+
+        # Motoristas novos só são inseridos no final, então linhas repetidas
+        # do mesmo motorista precisam reaproveitar o cadastro pendente.
+        mot_key = (mot_cpf, mot_nom_clean)
+        por_similaridade = False
+        if mot_key in mot_cache:
+            mot_id, novo_idx = mot_cache[mot_key]
+        else:
+            novo_idx = novos_por_cpf.get(mot_cpf) if mot_cpf else None
+            mot_id = None
+            if novo_idx is None:
+                mot_id = find_motorista(mot_nom, mot_cpf, by_cpf, by_name)
+                if mot_id is None:
+                    novo_idx = novos_por_nome.get(mot_nom_clean)
+                if mot_id is None and novo_idx is None:
+                    # Depende do estado do arquivo até aqui, por isso não vai para o cache.
+                    mot_id, novo_idx = find_similar(cursor, mot_nom, similares, motoristas_update, motoristas_insert)
+                    por_similaridade = True
+
+        if mot_id is not None:
+            # Mesma regra dos cadastros pendentes: o CPF/nome antigos do motorista
+            # (do banco ou de uma linha anterior) deixam de apontar para ele.
+            anteriores = motoristas_update.get(mot_id, atuais.get(mot_id))
+            if anteriores and drop_stale_keys(by_cpf, by_name, anteriores, valores, mot_id, ident=lambda entry: entry[0]):
+                mot_cache.clear()
+            motoristas_update[mot_id] = valores
+            if mot_cpf:
+                by_cpf[mot_cpf] = (mot_id, mot_nom)
+            by_name[mot_nom_clean] = (mot_id, mot_nom)
+        else:
+            if novo_idx is None:
+                novo_idx = len(motoristas_insert)
+                motoristas_insert.append(valores)
+            else:
+                # O cadastro pendente assume o CPF/nome desta linha; as chaves
+                # antigas deixam de apontar para ele, como aconteceria no banco.
+                anteriores = motoristas_insert[novo_idx]
+                if drop_stale_keys(novos_por_cpf, novos_por_nome, anteriores, valores, novo_idx):
+                    mot_cache.clear()
+                motoristas_insert[novo_idx] = valores
+            if mot_cpf:
+                novos_por_cpf[mot_cpf] = novo_idx
+            novos_por_nome[mot_nom_clean] = novo_idx
+        if not por_similaridade:
+            mot_cache[mot_key] = (mot_id, novo_idx)
+
+        linhas.append((line_number, vei_id, vei_plc, placa_car, mot_nom, mot_id, novo_idx))
+        logging.debug(f" Linha {line_number} processada.")
+
+    return linhas, motoristas_update, motoristas_insert
+
+def write_motoristas(cursor, motoristas_update, motoristas_insert, atuais):
+    # Os UPDATEs vêm antes do INSERT: um motorista do arquivo pode assumir o
+    # CPF que outro acabou de deixar, e com o índice único em mot_cpf o
+    # INSERT ... ON CONFLICT sobrescreveria o motorista antigo. Os CPFs que
+    # mudam são zerados antes de receber o valor novo, já que a checagem do
+    # índice único é feita linha a linha e uma troca de CPFs entre dois
+    # motoristas falharia no meio do UPDATE.
+    cursor.execute("""
+        CREATE TEMP TABLE stg_motorista ON COMMIT DROP AS
+        SELECT mot_id, cli_id, mot_nom, mot_tel, mot_cnh, mot_cpf, mot_rua, mot_num, mot_bai, mot_cid, mot_uf
+        FROM motorista
+        WITH NO DATA
+    """)
 
-def process_and_insert_data(file_name, conn):
-    if not file_name or not os.path.exists(file_name):
-        logging.error(f"Arquivo não encontrado: {file_name}")
-        return
+    # Motoristas cujos dados já estão iguais no banco não são reescritos.
+    alterados = [(mot_id,) + valores for mot_id, valores in motoristas_update.items() if atuais.get(mot_id) != valores]
+    logging.info(f" {len(motoristas_update) - len(alterados)} motoristas sem alteração")
+    copy_rows(cursor, "stg_motorista", alterados)
 
-    logging.info(f"Iniciando processamento do arquivo: {file_name}")
-    
-    encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-    file_content = None
-    used_encoding = None
-    
-    for enc in encodings:
+    cursor.execute("""
+        UPDATE motorista m
+        SET mot_cpf = NULL
+        FROM stg_motorista s
+        WHERE m.mot_id = s.mot_id
+          AND m.mot_cpf IS DISTINCT FROM s.mot_cpf;
+
+        UPDATE motorista m
+        SET cli_id = s.cli_id, mot_nom = s.mot_nom, mot_tel = s.mot_tel, mot_cnh = s.mot_cnh, mot_cpf = s.mot_cpf,
+            mot_rua = s.mot_rua, mot_num = s.mot_num, mot_bai = s.mot_bai, mot_cid = s.mot_cid, mot_uf = s.mot_uf
+        FROM stg_motorista s
+        WHERE m.mot_id = s.mot_id
+    """)
+    logging.info(f" {cursor.rowcount} motoristas atualizados")
+
+    novos_ids = []
+    if motoristas_insert:
+        # Com o índice único em mot_cpf, um CPF cadastrado por outro processo
+        # depois da carga inicial vira UPDATE em vez de duplicar o motorista.
+        on_conflict = ""
+        if has_cpf_unique_index(cursor):
+            on_conflict = """
+            ON CONFLICT (mot_cpf) DO UPDATE
+            SET cli_id = EXCLUDED.cli_id, mot_nom = EXCLUDED.mot_nom, mot_tel = EXCLUDED.mot_tel,
+                mot_cnh = EXCLUDED.mot_cnh, mot_rua = EXCLUDED.mot_rua, mot_num = EXCLUDED.mot_num,
+                mot_bai = EXCLUDED.mot_bai, mot_cid = EXCLUDED.mot_cid, mot_uf = EXCLUDED.mot_uf
+            """
+        else:
+            logging.warning(" Índice único em motorista.mot_cpf ausente; inserindo sem ON CONFLICT")
+        inseridos = psycopg2.extras.execute_values(
+            cursor,
+            f"""
+            INSERT INTO motorista (cli_id, mot_nom, mot_tel, mot_cnh, mot_cpf, mot_rua, mot_num, mot_bai, mot_cid, mot_uf, mot_mat)
+            VALUES %s
+            {on_conflict}
+            RETURNING mot_id, xmax = 0
+            """,
+            [valores + (None,) for valores in motoristas_insert],
+            page_size=500,
+            fetch=True
+        )
+        for (mot_id, novo), valores in zip(inseridos, motoristas_insert):
+            if novo:
+                logging.info(f" NOVO motorista cadastrado: ID {mot_id}, Nome: {valores[1]}")
+            else:
+                logging.info(f" Motorista atualizado por CPF já cadastrado: ID {mot_id}, Nome: {valores[1]}")
+            novos_ids.append(mot_id)
+
+    return novos_ids
+
+def decode_line(raw):
+    # Cada linha é decodificada isoladamente (utf-8, com latin-1 como fallback)
+    # para que o arquivo seja processado em streaming, sem carregá-lo inteiro.
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        logging.debug("Falha ao ler linha com encoding utf-8, usando latin-1...")
+        return raw.decode('latin-1')
+
+def queue_chunks(chunks):
+    while True:
+        chunk = chunks.get()
+        if chunk is DOWNLOAD_OK:
+            return
+        if chunk is DOWNLOAD_FAILED:
+            raise RuntimeError("download do FTP não foi concluído")
+        yield chunk
+
+def iter_lines(chunks):
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for raw in lines:
+            yield decode_line(raw)
+    if pending:
+        yield decode_line(pending)
+
+def iter_rows(lines):
+    # Uma linha que o csv não consegue ler (ex.: \r solto no meio de um campo)
+    # é registrada e ignorada como qualquer outro erro de layout.
+    reader = csv.reader(lines, delimiter=';', quoting=csv.QUOTE_NONE)
+    while True:
         try:
-            with open(file_name, 'r', encoding=enc) as file:
-                file_content = file.readlines()
-            used_encoding = enc
-            logging.info(f" Arquivo lido com encoding: {enc}")
-            break
-        except UnicodeDecodeError:
-            logging.debug(f"Falha ao ler com encoding {enc}, tentando próximo...")
+            data = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            logging.warning(f"Erro no layout da linha {reader.line_num}: {e}")
             continue
-    
-    if not file_content:
-        logging.error(f"✗ Não foi possível ler o arquivo com nenhum encoding suportado")
-        return
+        yield reader.line_num, data
+
+def process_and_insert_data(lines, conn):
+    logging.info("Iniciando processamento do arquivo recebido do FTP")
     
     try:
-        for line_number, line in enumerate(file_content, start=1):
-            data = line.strip().split(';')
-            
-            if len(data) < 17:
-                logging.warning(f"Erro no layout da linha {line_number}: esperado 17 colunas, recebeu {len(data)}")
-                continue
+        with conn.cursor() as cursor:
+            by_cpf, by_name, atuais = load_motoristas(cursor)
+
+            registros = []
+            a_buscar = set()
+
+            line_number = 0
+            for line_number, data in iter_rows(lines):
+                
+                if len(data) < 17:
+                    logging.warning(f"Erro no layout da linha {line_number}: esperado 17 colunas, recebeu {len(data)}")
+                    continue
 
-            try:
-                vei_id = int(data[0])
-                mot_id = int(data[6]) if data[6].isdigit() else None
-            except ValueError:
-                logging.warning(f"ID_FROTA_HPS ou CODIGO_RDC_MOTORISTA inválido na linha {line_number}: {data[0]}, {data[6]}") 
-                continue
-
-            vei_plc = data[1].strip()
-            mot_nom = data[4].strip() if data[4] and data[4].strip() != "EM DEFINICAO" else "EM DEFINICAO"
-            placa_car = data[5].strip()
-            mot_tel = data[7].strip() if data[7] and data[7].strip() else None
-            mot_cnh = data[9].strip() if data[9] and data[9].strip() else None
-            mot_cpf = formatar_cpf(data[10]) if data[10] else None
-            mot_rua = data[12].strip() if data[12] else None
-            mot_num = data[13].strip() if data[13] else None
-            mot_bai = data[14].strip() if len(data) > 14 and data[14] else None
-            mot_cid = data[15][:25].strip() if len(data) > 15 and data[15] else None
-            mot_uf = data[16].strip() if len(data) > 16 and data[16] else None
-
-            if vei_id == 51773:
-                logging.warning(f"[MONITOR] Veículo 51773 encontrado. Placa recebida do TXT: {vei_plc}")
-
-            if mot_id == 999999:
-                mot_id = None
-
-            cli_id = 269
-
-            logging.info(f"Processando: Motorista '{mot_nom}', CPF: {mot_cpf}, Veículo: {vei_id}")
-
-            with conn.cursor() as cursor:
                 try:
-                    cursor.execute("BEGIN;")
-
-                    existing_mot_id = find_motorista(cursor, mot_nom, mot_cpf)
-                    
-                    if existing_mot_id:
-                        mot_id = existing_mot_id
-                        cursor.execute(
-                            """
-                            UPDATE motorista
-                            SET cli_id = %s, mot_nom = %s, mot_tel = %s, mot_cnh = %s, mot_cpf = %s, 
-                                mot_rua = %s, mot_num = %s, mot_bai = %s, mot_cid = %s, mot_uf = %s
-                            WHERE mot_id = %s
-                            """,
-                            (cli_id, mot_nom, mot_tel, mot_cnh, mot_cpf, mot_rua, mot_num, mot_bai, mot_cid, mot_uf, mot_id)
-                        )
-                        logging.info(f" Motorista atualizado: ID {mot_id}, Nome: {mot_nom}")
-                    else:
-                        cursor.execute(
-                            """
-                            INSERT INTO motorista (cli_id, mot_nom, mot_tel, mot_cnh, mot_cpf, mot_rua, mot_num, mot_bai, mot_cid, mot_uf, mot_mat)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                            RETURNING mot_id
-                            """,
-                            (cli_id, mot_nom, mot_tel, mot_cnh, mot_cpf, mot_rua, mot_num, mot_bai, mot_cid, mot_uf, None)
-                        )
-                        mot_id = cursor.fetchone()[0]
-                        logging.info(f" NOVO motorista cadastrado: ID {mot_id}, Nome: {mot_nom}")
-
-                    cursor.execute(
-                        """
-                        UPDATE grid_ext
-                        SET placa_car = %s, mot_nom = %s, mot_id = %s
-                        WHERE vei_id = %s
-                        """,
-                        (placa_car, mot_nom, mot_id, vei_id)
-                    )
-                    if cursor.rowcount == 0:
-                        logging.warning(f" Nenhuma atualização na grid_ext para veículo {vei_id}")
-                    else:
-                        logging.info(f" Grid_ext atualizado para veículo {vei_id}")
-
-                    cursor.execute(
-                        """
-                        UPDATE cad_veiculo
-                        SET vei_plc = %s
-                        WHERE vei_id = %s
-                        """,
-                        (vei_plc, vei_id)
-                    )
-                    logging.info(f" Cad_veiculo atualizado: Veículo {vei_id}, Placa: {vei_plc}")
-
-                    cursor.execute(
-                        """
-                        UPDATE last_datastore
-                        SET vei_id = %s
-                        WHERE vei_id = %s
-                        """,
-                        (vei_id, vei_id)
-                    )
-                    logging.info(f" Last_datastore atualizado para veículo {vei_id}")
-
-                    cursor.execute("COMMIT;")
-                    logging.info(f" Transação commitada para linha {line_number}")
-
-                except Exception as e:
-                    cursor.execute("ROLLBACK;")
-                    logging.error(f"✗ Erro na transação linha {line_number}: {e}")
-
-            logging.debug(f" Linha {line_number} processada.")
+                    vei_id = int(data[0])
+                    mot_id = int(data[6]) if data[6].isdigit() else None
+                except ValueError:
+                    logging.warning(f"ID_FROTA_HPS ou CODIGO_RDC_MOTORISTA inválido na linha {line_number}: {data[0]}, {data[6]}") 
+                    continue
+
+                vei_plc = data[1].strip()
+                mot_nom = data[4].strip() if data[4] and data[4].strip() != "EM DEFINICAO" else "EM DEFINICAO"
+                placa_car = data[5].strip()
+                mot_tel = data[7].strip() if data[7] and data[7].strip() else None
+                mot_cnh = data[9].strip() if data[9] and data[9].strip() else None
+                mot_cpf = formatar_cpf(data[10]) if data[10] else None
+                mot_rua = data[12].strip() if data[12] else None
+                mot_num = data[13].strip() if data[13] else None
+                mot_bai = data[14].strip() if len(data) > 14 and data[14] else None
+                mot_cid = data[15][:25].strip() if len(data) > 15 and data[15] else None
+                mot_uf = data[16].strip() if len(data) > 16 and data[16] else None
+
+                if vei_id == 51773:
+                    logging.warning(f"[MONITOR] Veículo 51773 encontrado. Placa recebida do TXT: {vei_plc}")
+
+                cli_id = 269
+
+                valores = (cli_id, mot_nom, mot_tel, mot_cnh, mot_cpf, mot_rua, mot_num, mot_bai, mot_cid, mot_uf)
+                mot_nom_clean = mot_nom.strip().upper()
+                if mot_cpf not in by_cpf and mot_nom_clean not in by_name:
+                    a_buscar.add(mot_nom_clean)
+
+                registros.append((line_number, vei_id, vei_plc, placa_car, valores))
+
+            if line_number == 0:
+                logging.error("✗ Arquivo vazio")
+                conn.rollback()
+                return
+
+            similares = find_similares(cursor, a_buscar)
+
+            linhas, motoristas_update, motoristas_insert = resolve_motoristas(cursor, registros, by_cpf, by_name, atuais, similares)
+
+            novos_ids = write_motoristas(cursor, motoristas_update, motoristas_insert, atuais)
+
+            veiculos = {}
+            for line_number, vei_id, vei_plc, placa_car, mot_nom, mot_id, novo_idx in linhas:
+                if mot_id is None:
+                    mot_id = novos_ids[novo_idx]
+                veiculos[vei_id] = (vei_id, vei_plc, placa_car, mot_nom, mot_id)
+
+            cursor.execute("""
+                CREATE TEMP TABLE stg_veiculo ON COMMIT DROP AS
+                SELECT g.vei_id, c.vei_plc, g.placa_car, g.mot_nom, g.mot_id
+                FROM grid_ext g, cad_veiculo c
+                WITH NO DATA
+            """)
+            copy_rows(cursor, "stg_veiculo", veiculos.values())
+
+            # Os dois UPDATEs vão em um único comando (CTEs de modificação),
+            # ou seja, uma só ida e volta ao servidor.
+            cursor.execute("""
+                WITH upd_grid_ext AS (
+                    UPDATE grid_ext g
+                    SET placa_car = s.placa_car, mot_nom = s.mot_nom, mot_id = s.mot_id
+                    FROM stg_veiculo s
+                    WHERE g.vei_id = s.vei_id
+                      AND (g.placa_car, g.mot_nom, g.mot_id) IS DISTINCT FROM (s.placa_car, s.mot_nom, s.mot_id)
+                    RETURNING g.vei_id
+                ), upd_cad_veiculo AS (
+                    UPDATE cad_veiculo c
+                    SET vei_plc = s.vei_plc
+                    FROM stg_veiculo s
+                    WHERE c.vei_id = s.vei_id
+                      AND c.vei_plc IS DISTINCT FROM s.vei_plc
+                    RETURNING c.vei_id
+                )
+                SELECT (SELECT count(*) FROM upd_grid_ext),
+                       (SELECT count(*) FROM upd_cad_veiculo),
+                       ARRAY(SELECT s.vei_id FROM stg_veiculo s
+                             WHERE NOT EXISTS (SELECT 1 FROM grid_ext g WHERE g.vei_id = s.vei_id))
+            """)
+            total_grid_ext, total_cad_veiculo, sem_grid_ext = cursor.fetchone()
+            for vei_id in sem_grid_ext:
+                logging.warning(f" Nenhuma atualização na grid_ext para veículo {vei_id}")
+            logging.info(f" Grid_ext atualizado para {total_grid_ext} veículos")
+            logging.info(f" Cad_veiculo atualizado para {total_cad_veiculo} veículos")
+
+        conn.commit()
+        logging.info(f" Transação commitada: {len(linhas)} linhas processadas")
 
     except Exception as e:
-        logging.error(f"Erro ao processar o arquivo {file_name}: {e}")
+        conn.rollback()
+        logging.error(f"Erro ao processar o arquivo: {e}")
+
+def download_and_process(conn):
+    # O download (produtor) alimenta a fila enquanto a thread de processamento
+    # (consumidor) já interpreta as linhas e consulta o banco.
+    chunks = queue.Queue()
+    worker = threading.Thread(target=process_and_insert_data, args=(iter_lines(queue_chunks(chunks)), conn))
+    worker.start()
+
+    file_name = None
+    try:
+        file_name = download_ftp_file(chunks.put)
+    finally:
+        chunks.put(DOWNLOAD_OK if file_name else DOWNLOAD_FAILED)
+        worker.join()
+
+    return file_name
 
 def main():
     logging.info("=" * 80)
@@ -304,15 +690,15 @@ def main():
         input("Pressione ENTER para fechar...")
         return
 
-    file_name = download_ftp_file()
+    ensure_indexes(conn)
+
+    file_name = download_and_process(conn)
     if not file_name:
         logging.error("Não foi possível baixar o arquivo do FTP. Abortando.")
         conn.close()
         input("Pressione ENTER para fechar...")
         return
 
-    process_and_insert_data(file_name, conn)
-
     conn.close()
     logging.info("Conexão com o banco de dados fechada.")
 
@@ -0,0 +1,64 @@
+import os
+import queue
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Script_FTP_Integracao import DOWNLOAD_FAILED, DOWNLOAD_OK, iter_lines, iter_rows, queue_chunks
+
+
+def fila(*chunks):
+    chunks_queue = queue.Queue()
+    for chunk in chunks:
+        chunks_queue.put(chunk)
+    return chunks_queue
+
+
+class IterLinesTest(unittest.TestCase):
+    def test_line_split_across_chunks(self):
+        lines = list(iter_lines([b"1;AB", b"C\n2;", b"D\n"]))
+
+        self.assertEqual(lines, ["1;ABC", "2;D"])
+
+    def test_crlf_keeps_carriage_return_for_csv(self):
+        lines = list(iter_lines([b"1;A\r", b"\n2;B\r\n"]))
+
+        self.assertEqual(lines, ["1;A\r", "2;B\r"])
+
+    def test_last_line_without_newline(self):
+        lines = list(iter_lines([b"1;A\n2;B"]))
+
+        self.assertEqual(lines, ["1;A", "2;B"])
+
+    def test_latin1_line_is_decoded(self):
+        lines = list(iter_lines(["JOSÉ\n".encode("latin-1"), "JOSÉ\n".encode("utf-8")]))
+
+        self.assertEqual(lines, ["JOSÉ", "JOSÉ"])
+
+    def test_download_ok_ends_stream(self):
+        lines = list(iter_lines(queue_chunks(fila(b"1;A\n", b"2;B", DOWNLOAD_OK, b"3;C\n"))))
+
+        self.assertEqual(lines, ["1;A", "2;B"])
+
+    def test_download_failed_raises(self):
+        lines = iter_lines(queue_chunks(fila(b"1;A\n2;", DOWNLOAD_FAILED)))
+
+        self.assertEqual(next(lines), "1;A")
+        with self.assertRaises(RuntimeError):
+            next(lines)
+
+
+class IterRowsTest(unittest.TestCase):
+    def test_bare_carriage_return_skips_only_that_line(self):
+        lines = ["1;A\r\n", "2;B\rX\n", "3;C\n"]
+
+        with self.assertLogs(level="WARNING") as logs:
+            rows = list(iter_rows(lines))
+
+        self.assertEqual(rows, [(1, ["1", "A"]), (3, ["3", "C"])])
+        self.assertIn("Erro no layout da linha 2", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Script_FTP_Integracao import latest_by_filename
+
+
+class LatestByFilenameTest(unittest.TestCase):
+    def test_picks_latest_stamp(self):
+        files = ["frota_20240101.txt", "frota_20240315.txt", "frota_20240210.txt"]
+
+        self.assertEqual(latest_by_filename(files), "frota_20240315.txt")
+
+    def test_short_stamps_are_padded(self):
+        files = ["frota_20240315.txt", "frota_202403150930.txt", "frota_20240315093015.txt"]
+
+        self.assertEqual(latest_by_filename(files), "frota_20240315093015.txt")
+        self.assertEqual(latest_by_filename(files[:2]), "frota_202403150930.txt")
+
+    def test_stamp_is_read_from_basename(self):
+        files = ["/20991231/frota_20240101.txt", "/20000101/frota_20240102.txt"]
+
+        self.assertEqual(latest_by_filename(files), "/20000101/frota_20240102.txt")
+
+    def test_invalid_dates_are_ignored(self):
+        files = ["frota_20241340.txt", "frota_20240101.txt", "frota_20240102.txt"]
+
+        self.assertEqual(latest_by_filename(files), "frota_20240102.txt")
+
+    def test_needs_a_majority_of_stamped_names(self):
+        self.assertIsNone(latest_by_filename(["frota_20240101.txt", "frota.txt"]))
+        self.assertIsNone(latest_by_filename(["frota_20241340.txt", "frota_20240101.txt"]))
+        self.assertEqual(latest_by_filename(["frota_20240101.txt", "frota_20240102.txt", "frota.txt"]), "frota_20240102.txt")
+
+
+if __name__ == "__main__":
+    unittest.main()
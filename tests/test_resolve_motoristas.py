@@ -0,0 +1,76 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Script_FTP_Integracao import resolve_motoristas
+
+
+def registro(line_number, vei_id, mot_nom, mot_cpf):
+    valores = (269, mot_nom, None, None, mot_cpf, None, None, None, None, None)
+    return (line_number, vei_id, f"PLC{vei_id}", f"CAR{vei_id}", valores)
+
+
+class ResolveMotoristasTest(unittest.TestCase):
+    def test_pending_driver_takes_new_cpf_and_name(self):
+        registros = [
+            registro(1, 10, "JOAO", "111.111.111-11"),
+            registro(2, 20, "JOAO", "222.222.222-22"),
+            registro(3, 30, "PEDRO", "222.222.222-22"),
+        ]
+
+        linhas, motoristas_update, motoristas_insert = resolve_motoristas(None, registros, {}, {}, {}, {"JOAO": [], "PEDRO": []})
+
+        self.assertEqual(motoristas_update, {})
+        self.assertEqual(len(motoristas_insert), 1)
+        self.assertEqual(motoristas_insert[0][1], "PEDRO")
+        self.assertEqual(motoristas_insert[0][4], "222.222.222-22")
+        self.assertEqual({linha[6] for linha in linhas}, {0})
+
+    def test_existing_driver_loses_previous_cpf(self):
+        atuais = {
+            5: (269, "ANA", None, None, "111.111.111-11", None, None, None, None, None),
+            6: (269, "BIA", None, None, None, None, None, None, None, None),
+        }
+        by_cpf = {"111.111.111-11": (5, "ANA")}
+        by_name = {"ANA": (5, "ANA"), "BIA": (6, "BIA")}
+        registros = [
+            registro(1, 10, "ANA", "222.222.222-22"),
+            registro(2, 20, "BIA", "111.111.111-11"),
+        ]
+
+        linhas, motoristas_update, motoristas_insert = resolve_motoristas(None, registros, by_cpf, by_name, atuais, {})
+
+        self.assertEqual(motoristas_insert, [])
+        self.assertEqual(motoristas_update[5][1], "ANA")
+        self.assertEqual(motoristas_update[5][4], "222.222.222-22")
+        self.assertEqual(motoristas_update[6][1], "BIA")
+        self.assertEqual(motoristas_update[6][4], "111.111.111-11")
+        self.assertEqual([linha[5] for linha in linhas], [5, 6])
+
+    def test_similar_name_matches_pending_driver(self):
+        registros = [
+            registro(1, 10, "JOAO SILVA", "111.111.111-11"),
+            registro(2, 20, "SILVA", None),
+        ]
+        similares = {"JOAO SILVA": [], "SILVA": []}
+
+        linhas, motoristas_update, motoristas_insert = resolve_motoristas(None, registros, {}, {}, {}, similares)
+
+        self.assertEqual(len(motoristas_insert), 1)
+        self.assertEqual([linha[6] for linha in linhas], [0, 0])
+
+    def test_ambiguous_similar_name_lists_every_candidate(self):
+        registros = [registro(1, 10, "SILVA", None)]
+        similares = {"SILVA": [(1, "ANA SILVA"), (2, "BIA SILVA"), (3, "CAIO SILVA")]}
+
+        with self.assertLogs(level="WARNING") as logs:
+            linhas, motoristas_update, motoristas_insert = resolve_motoristas(None, registros, {}, {}, {}, similares)
+
+        self.assertEqual(len(motoristas_insert), 1)
+        self.assertIn("CAIO SILVA", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Script_FTP_Integracao
+from Script_FTP_Integracao import resolve_motoristas, write_motoristas
+
+
+def registro(line_number, vei_id, mot_nom, mot_cpf):
+    valores = (269, mot_nom, None, None, mot_cpf, None, None, None, None, None)
+    return (line_number, vei_id, f"PLC{vei_id}", f"CAR{vei_id}", valores)
+
+
+class MotoristaCursor:
+    # Simula a tabela motorista com índice único em mot_cpf, checado linha a
+    # linha como no PostgreSQL, para os comandos emitidos por write_motoristas.
+    def __init__(self, atuais):
+        self.motoristas = {mot_id: list(valores) for mot_id, valores in atuais.items()}
+        self.staged = []
+        self.rowcount = -1
+        self._fetch = None
+
+    def _set_cpf(self, mot_id, cpf):
+        if cpf is not None:
+            for outro_id, valores in self.motoristas.items():
+                if outro_id != mot_id and valores[4] == cpf:
+                    raise AssertionError(f"CPF {cpf} duplicado entre {outro_id} e {mot_id}")
+        self.motoristas[mot_id][4] = cpf
+
+    def copy_expert(self, sql, buffer):
+        for line in buffer.getvalue().splitlines():
+            values = [None if value == "\\N" else value for value in line.split("\t")]
+            self.staged.append((int(values[0]), tuple(values[1:])))
+
+    def execute(self, sql, params=None):
+        if "SET mot_cpf = NULL" in sql:
+            for mot_id, valores in self.staged:
+                if self.motoristas[mot_id][4] != valores[4]:
+                    self._set_cpf(mot_id, None)
+        if "SET cli_id = s.cli_id" in sql:
+            # A ordem em que o UPDATE visita as linhas não é garantida; o
+            # inverso da ordem do COPY expõe conflitos da checagem linha a linha.
+            for mot_id, valores in reversed(self.staged):
+                self._set_cpf(mot_id, valores[4])
+                self.motoristas[mot_id] = list(valores)
+            self.rowcount = len(self.staged)
+        if "pg_index" in sql:
+            self._fetch = (1,)
+
+    def fetchone(self):
+        return self._fetch
+
+    def insert(self, cursor, sql, rows, page_size=100, fetch=False):
+        inseridos = []
+        for row in rows:
+            valores = list(row[:10])
+            existente = [mot_id for mot_id, atual in self.motoristas.items() if valores[4] and atual[4] == valores[4]]
+            if existente:
+                self.motoristas[existente[0]][:4] = valores[:4]
+                self.motoristas[existente[0]][5:] = valores[5:]
+                inseridos.append((existente[0], False))
+            else:
+                mot_id = max(self.motoristas, default=0) + 1
+                self.motoristas[mot_id] = valores
+                inseridos.append((mot_id, True))
+        return inseridos
+
+
+class WriteMotoristasTest(unittest.TestCase):
+    def write(self, atuais, registros):
+        by_cpf = {valores[4]: (mot_id, valores[1]) for mot_id, valores in atuais.items() if valores[4]}
+        by_name = {valores[1]: (mot_id, valores[1]) for mot_id, valores in atuais.items()}
+        similares = {registro[4][1]: [] for registro in registros}
+        linhas, motoristas_update, motoristas_insert = resolve_motoristas(None, registros, by_cpf, by_name, atuais, similares)
+
+        cursor = MotoristaCursor(atuais)
+        with mock.patch.object(Script_FTP_Integracao.psycopg2.extras, "execute_values", cursor.insert, create=True):
+            novos_ids = write_motoristas(cursor, motoristas_update, motoristas_insert, atuais)
+        return cursor.motoristas, novos_ids
+
+    def test_new_driver_takes_cpf_released_in_the_same_file(self):
+        atuais = {5: (269, "ANA", None, None, "111.111.111-11", None, None, None, None, None)}
+        registros = [
+            registro(1, 10, "ANA", "222.222.222-22"),
+            registro(2, 20, "NOVO", "111.111.111-11"),
+        ]
+
+        motoristas, novos_ids = self.write(atuais, registros)
+
+        self.assertEqual(motoristas[5][1], "ANA")
+        self.assertEqual(motoristas[5][4], "222.222.222-22")
+        self.assertEqual(len(novos_ids), 1)
+        self.assertNotEqual(novos_ids[0], 5)
+        self.assertEqual(motoristas[novos_ids[0]][1], "NOVO")
+        self.assertEqual(motoristas[novos_ids[0]][4], "111.111.111-11")
+
+    def test_cpf_moves_between_existing_drivers(self):
+        atuais = {
+            5: (269, "ANA", None, None, "111.111.111-11", None, None, None, None, None),
+            6: (269, "BIA", None, None, None, None, None, None, None, None),
+        }
+        registros = [
+            registro(1, 10, "ANA", "222.222.222-22"),
+            registro(2, 20, "BIA", "111.111.111-11"),
+        ]
+
+        motoristas, novos_ids = self.write(atuais, registros)
+
+        self.assertEqual(novos_ids, [])
+        self.assertEqual(motoristas[5][4], "222.222.222-22")
+        self.assertEqual(motoristas[6][4], "111.111.111-11")
+
+
+if __name__ == "__main__":
+    unittest.main()